@@ -20,10 +20,13 @@
 from collections import namedtuple
 from datetime import datetime
 
-import http.client as http
-import json
 import logging
-import urllib.parse
+import requests
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 Data = namedtuple("Data", ["channelid", "startdate", "enddate", "intervaltype", "data"])
@@ -34,14 +37,30 @@ DataNow = namedtuple("DataNow", ["channelid", "createddate", "power"])
 
 
 def parse_datetime(date):
-    return datetime.strptime(date, "%Y-%m-%dT%H:%M:%S")
+    # Fixed format (%Y-%m-%dT%H:%M:%S), slicing is a lot faster than strptime.
+    # Reject anything else (e.g. a time zone suffix) like strptime did.
+    if len(date) != 19 or date[4:17:3] != "--T::":
+        raise ValueError("time data %r does not match format" % date)
+    return datetime(
+        int(date[0:4]),
+        int(date[5:7]),
+        int(date[8:10]),
+        int(date[11:13]),
+        int(date[14:16]),
+        int(date[17:19]),
+    )
 
 
 class EliqOnline:
-    def __init__(self, access_token, server="my.eliq.io", port=http.HTTPS_PORT):
+    def __init__(self, access_token, server="my.eliq.io", port=443):
         self.access_token = access_token
         self.server = server
         self.port = port
+        self.url = "https://%s:%d" % (server, port)
+        self.session = requests.Session()
+
+    def close(self):
+        self.session.close()
 
     def _send_request(self, url, params):
         # Don't include access token in log
@@ -52,19 +71,16 @@ class EliqOnline:
         logging.debug("GET %s: %s", url, params)
         params["accesstoken"] = self.access_token
 
-        conn = http.HTTPSConnection(self.server, self.port)
-        conn.request("GET", "%s?%s" % (url, urllib.parse.urlencode(params)))
+        req = self.session.get(self.url + url, params=params, allow_redirects=False)
 
-        response = conn.getresponse()
-        status = response.status
-        reason = response.reason
-        body = response.read().decode("utf-8")
-        logging.debug("HTTP response: %d (%s): %s", status, reason, body)
+        status = req.status_code
+        reason = req.reason
+        body = req.content
+        logging.debug("HTTP response: %d (%s): %s", status, reason, body[:200])
 
-        if status != http.OK and status != http.CREATED:
+        if status != requests.codes.ok and status != requests.codes.created:
             raise Exception("HTTP request to %s failed" % self.server)
 
-        conn.close()
         return (status, reason, body)
 
     def get_data_now(self, channel_id=None):
@@ -73,7 +89,7 @@ class EliqOnline:
             params["channelid"] = channel_id
 
         (_, _, body) = self._send_request("/api/datanow", params)
-        result = json.loads(body)
+        result = json_loads(body)
 
         return DataNow(
             result["channelid"], parse_datetime(result["createddate"]), result["power"]
@@ -92,26 +108,25 @@ class EliqOnline:
             params["channelid"] = channel_id
 
         (_, _, body) = self._send_request("/api/data", params)
-        result = json.loads(body)
-
-        data = Data(
+        result = json_loads(body)
+
+        entries = [
+            DataEntry(
+                entry["avgpower"],
+                entry["energy"],
+                entry["temp_out"],
+                parse_datetime(entry["time_start"]),
+                parse_datetime(entry["time_end"]),
+            )
+            for entry in result["data"]
+        ]
+        return Data(
             result["channelid"],
             parse_datetime(result["startdate"]),
             parse_datetime(result["enddate"]),
             result["intervaltype"],
-            [],
+            entries,
         )
-        for entry in result["data"]:
-            data.data.append(
-                DataEntry(
-                    entry["avgpower"],
-                    entry["energy"],
-                    entry["temp_out"],
-                    parse_datetime(entry["time_start"]),
-                    parse_datetime(entry["time_end"]),
-                )
-            )
-        return data
 
     def get_day_data(self, start, end=None, channel_id=None):
         return self._get_data("day", start, end, channel_id)
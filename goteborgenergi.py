@@ -19,38 +19,49 @@
 
 from datetime import date
 
-import http.client as http
-import http.cookies as cookies
-import json
 import logging
 import re
-import urllib.parse
+import requests
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 class MonthEnergy:
     def __init__(self, data):
         self.data = data
+        # Index the series by day once, instead of scanning them for each day
+        self._total_by_day = {
+            int(e["name"]): int(e["y"] * 1000) for e in data["series"][0]["data"] if e
+        }
+        # Only group the hourly entries by day here. They are converted and
+        # checked the first time a day is looked up, as a bad entry should
+        # only matter for the days actually asked for.
+        self._hours_by_day = {}
+        for entry in data["drilldown"]["series"]:
+            if entry:
+                hours = self._hours_by_day.setdefault(int(entry["name"]), [])
+                hours.extend(entry["data"])
+        self._wh_by_day = {}
 
     def get_day_energy(self, date):
-        total = None
-        hours = 24 * [None]
-
-        for entry in self.data["series"][0]["data"]:
-            if entry and date.day == int(entry["name"]):
-                total = int(entry["y"] * 1000)
-                break
-
+        total = self._total_by_day.get(date.day)
         if total is None:
-            return (total, hours)
+            return (total, 24 * [None])
 
-        for entry in self.data["drilldown"]["series"]:
-            if entry and date.day == int(entry["name"]):
-                for h in entry["data"]:
-                    hour = int(h["name"])
-                    assert hour >= 0 and hour <= 23
-                    assert h["y"] >= 0
-                    hours[hour] = int(h["y"] * 1000)
-        return (total, hours)
+        wh = self._wh_by_day.get(date.day)
+        if wh is None:
+            wh = 24 * [None]
+            for h in self._hours_by_day.get(date.day, []):
+                hour = int(h["name"])
+                y = h["y"]
+                assert hour >= 0 and hour <= 23
+                assert y >= 0
+                wh[hour] = int(y * 1000)
+            self._wh_by_day[date.day] = wh
+        return (total, list(wh))
 
 
 class GoteborgEnergi:
@@ -60,143 +71,120 @@ class GoteborgEnergi:
     ENERGY_PATH = "/din-sida/elforbrukning-och-elavtal/"
     BY_HOUR_PATH = "/din-sida/elforbrukning-och-elavtal/GetConsumptionByHour/"
 
+    LOGIN_TOKEN_RE = re.compile(
+        r'name="__RequestVerificationToken" type="hidden" value="([^"]+)'
+    )
+    ENERGY_FORM_ID = 'id="get-consumption-form"'
+    ENERGY_TOKEN_RE = re.compile(
+        r'<input name="__RequestVerificationToken" [^>]*?value="([^"]+)"'
+    )
+
     def __init__(self, username, password):
         self.username = username
         self.password = password
-        self.cookies = None
-        self.headers = {"Accept": "*/*"}
-
-    def _set_cookies(self, response):
-        if not self.cookies:
-            self.cookies = cookies.SimpleCookie()
+        self.session = requests.Session()
+        self.session.headers.update({"Accept": "*/*"})
 
-        for c in response.getheader("Set-Cookie", "").split(", "):
-            self.cookies.load(c)
-
-        cookie = self.cookies.output(attrs={}, header="", sep=";")
-        self.headers["Cookie"] = cookie.lstrip()
+    def _url(self, path):
+        return "https://%s%s" % (GoteborgEnergi.SERVER, path)
 
     def log_in(self):
-        conn = http.HTTPSConnection(GoteborgEnergi.SERVER)
-
-        conn.request("GET", GoteborgEnergi.LOGIN_PATH)
-        response = conn.getresponse()
+        response = self.session.get(self._url(GoteborgEnergi.LOGIN_PATH))
 
         logging.debug(
             "Get %s: %d (%s)",
             GoteborgEnergi.LOGIN_PATH,
-            response.status,
+            response.status_code,
             response.reason,
         )
-        if response.status != http.OK:
+        if response.status_code != requests.codes.ok:
             raise Exception("Failed to get login page")
 
-        self._set_cookies(response)
-
-        match = re.search(
-            r'name="__RequestVerificationToken" type="hidden" value="([^"]+)',
-            response.read().decode("utf-8"),
-        )
+        match = GoteborgEnergi.LOGIN_TOKEN_RE.search(response.text)
         if not match:
             raise Exception("Failed to detect login token")
 
-        params = urllib.parse.urlencode(
-            {
-                "ReturnUrl": "",
-                "KeepMeLoggedIn": "false",
-                "Username": self.username,
-                "Password": self.password,
-                "__RequestVerificationToken": match.group(1),
-            }
-        )
-
-        headers = self.headers.copy()
-        headers["Content-type"] = "application/x-www-form-urlencoded"
+        params = {
+            "ReturnUrl": "",
+            "KeepMeLoggedIn": "false",
+            "Username": self.username,
+            "Password": self.password,
+            "__RequestVerificationToken": match.group(1),
+        }
 
-        conn.request("POST", GoteborgEnergi.LOGIN_PATH, params, headers)
-        response = conn.getresponse()
+        response = self.session.post(
+            self._url(GoteborgEnergi.LOGIN_PATH), data=params, allow_redirects=False
+        )
 
         logging.debug(
             "Post %s: %d (%s)",
             GoteborgEnergi.LOGIN_PATH,
-            response.status,
+            response.status_code,
             response.reason,
         )
-        if response.status != http.FOUND:
+        if response.status_code != requests.codes.found:
             raise Exception("Failed to log in")
 
-        self._set_cookies(response)
-        conn.close()
-
     def log_out(self):
-        conn = http.HTTPSConnection(GoteborgEnergi.SERVER)
-
-        conn.request("GET", GoteborgEnergi.LOGOUT_PATH, headers=self.headers)
-        response = conn.getresponse()
+        response = self.session.get(
+            self._url(GoteborgEnergi.LOGOUT_PATH), allow_redirects=False
+        )
 
         logging.debug(
             "Get %s: %d (%s)",
             GoteborgEnergi.LOGOUT_PATH,
-            response.status,
+            response.status_code,
             response.reason,
         )
-        if response.status != http.FOUND:
+        if response.status_code != requests.codes.found:
             raise Exception("Faild to log out")
 
-        self.cookies = None
-        conn.close()
+        self.session.cookies.clear()
 
     def get_month_energy(self, podid, date):
-        conn = http.HTTPSConnection(GoteborgEnergi.SERVER)
-
-        path = "%s?%s" % (
-            GoteborgEnergi.ENERGY_PATH,
-            urllib.parse.urlencode({"podid": podid}),
+        response = self.session.get(
+            self._url(GoteborgEnergi.ENERGY_PATH),
+            params={"podid": podid},
+            allow_redirects=False,
         )
-        conn.request("GET", path, headers=self.headers)
-        response = conn.getresponse()
 
-        logging.debug("Get %s: %d (%s)", path, response.status, response.reason)
-        if response.status != http.OK:
+        logging.debug(
+            "Get %s: %d (%s)", response.url, response.status_code, response.reason
+        )
+        if response.status_code != requests.codes.ok:
             raise Exception("Faild to load energy page")
 
-        match = re.search(
-            r'<form.*? id="get-consumption-form" .*?'
-            '<input name="__RequestVerificationToken" .*? value="([^"]+)"',
-            response.read().decode("utf-8"),
-            re.S,
-        )
+        # Locate the form with a plain substring search and only run the regex
+        # from there, instead of letting .*? backtrack over the whole page.
+        text = response.text
+        start = text.find(GoteborgEnergi.ENERGY_FORM_ID)
+        match = None
+        if start >= 0:
+            match = GoteborgEnergi.ENERGY_TOKEN_RE.search(text, start)
         if not match:
             raise Exception("Failed to detect energy token")
 
-        params = urllib.parse.urlencode(
-            {
-                "PodId": podid,
-                "year": date.year,
-                "month": date.month,
-                "__RequestVerificationToken": match.group(1),
-            }
-        )
-
-        headers = self.headers.copy()
-        headers["Content-type"] = "application/x-www-form-urlencoded"
+        params = {
+            "PodId": podid,
+            "year": date.year,
+            "month": date.month,
+            "__RequestVerificationToken": match.group(1),
+        }
 
-        conn.request("POST", GoteborgEnergi.BY_HOUR_PATH, params, headers)
-        response = conn.getresponse()
+        response = self.session.post(
+            self._url(GoteborgEnergi.BY_HOUR_PATH), data=params, allow_redirects=False
+        )
 
         logging.debug(
             "Post %s: %d (%s)",
             GoteborgEnergi.BY_HOUR_PATH,
-            response.status,
+            response.status_code,
             response.reason,
         )
-        if response.status != http.OK:
+        if response.status_code != requests.codes.ok:
             raise Exception("Failed to get by hour energy")
 
-        data = json.loads(response.read().decode("utf-8"))
-        conn.close()
-
-        return MonthEnergy(data)
+        return MonthEnergy(json_loads(response.content))
 
 
 if __name__ == "__main__":
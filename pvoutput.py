@@ -18,29 +18,33 @@
 # USA
 
 from collections import namedtuple
-from datetime import datetime
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Optional
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import functools
 import logging
+import random
 import requests
 import time
 import urllib.parse
 
 
-Output = namedtuple(
-    "Output",
-    [
-        "date",
-        "generated",
-        "efficiency",
-        "exported",
-        "import_peak",
-        "import_off_peak",
-        "import_shoulder",
-        "import_high_shoulder",
-        "consumption",
-    ],
-)
-DefaultOutput = Output(None, None, None, None, None, None, None, None, None)
+@dataclass
+class Output:
+    date: Optional["date"] = None
+    generated: Optional[int] = None
+    efficiency: Optional[float] = None
+    exported: Optional[int] = None
+    import_peak: Optional[int] = None
+    import_off_peak: Optional[int] = None
+    import_shoulder: Optional[int] = None
+    import_high_shoulder: Optional[int] = None
+    consumption: Optional[int] = None
+
 
 Extended = namedtuple(
     "Extended",
@@ -55,35 +59,77 @@ Extended = namedtuple(
     ],
 )
 
-Status = namedtuple(
-    "Status",
-    [
-        "datetime",
-        "energy_generation",
-        "power_generation",
-        "energy_consumption",
-        "power_consumption",
-        "efficiency",
-        "temperature",
-        "voltage",
-        "extended_1",
-        "extended_2",
-        "extended_3",
-        "extended_4",
-        "extended_5",
-        "extended_6",
-    ],
+
+@dataclass
+class Status:
+    datetime: Optional["datetime"] = None
+    energy_generation: Optional[int] = None
+    power_generation: Optional[int] = None
+    energy_consumption: Optional[int] = None
+    power_consumption: Optional[int] = None
+    efficiency: Optional[float] = None
+    temperature: Optional[float] = None
+    voltage: Optional[float] = None
+    extended_1: Optional[float] = None
+    extended_2: Optional[float] = None
+    extended_3: Optional[float] = None
+    extended_4: Optional[float] = None
+    extended_5: Optional[float] = None
+    extended_6: Optional[float] = None
+
+
+# (parameter, field, converter) for the values sent by add_output/add_status.
+# The order of STATUS_PARAMS is also the column order in add_batch_status.
+OUTPUT_PARAMS = (
+    ("g", "generated", int),
+    ("e", "exported", int),
+    ("ip", "import_peak", int),
+    ("io", "import_off_peak", int),
+    ("is", "import_shoulder", int),
+    ("ih", "import_high_shoulder", int),
+    ("c", "consumption", int),
 )
-DefaultStatus = Status(
-    None, None, None, None, None, None, None, None, None, None, None, None, None, None
+STATUS_PARAMS = (
+    ("v1", "energy_generation", int),
+    ("v2", "power_generation", int),
+    ("v3", "energy_consumption", int),
+    ("v4", "power_consumption", int),
+    ("v5", "temperature", float),
+    ("v6", "voltage", float),
+    ("v7", "extended_1", float),
+    ("v8", "extended_2", float),
+    ("v9", "extended_3", float),
+    ("v10", "extended_4", float),
+    ("v11", "extended_5", float),
+    ("v12", "extended_6", float),
 )
 
 
-def value(obj, field, converter):
-    v = getattr(obj, field)
-    if v is None:
-        return ""
-    return str(converter(v))
+def add_params(params, obj, fields):
+    for param, field, converter in fields:
+        v = getattr(obj, field)
+        if v is not None:
+            params[param] = str(converter(v))
+    return params
+
+
+def format_date(d):
+    return "%04d%02d%02d" % (d.year, d.month, d.day)
+
+
+def format_time(t):
+    return "%02d:%02d" % (t.hour, t.minute)
+
+
+@functools.lru_cache(maxsize=512)
+def parse_date(d):
+    # PVOutput always returns dates as yyyymmdd
+    return date(int(d[0:4]), int(d[4:6]), int(d[6:8]))
+
+
+def parse_datetime(d, t):
+    day = parse_date(d)
+    return datetime(day.year, day.month, day.day, int(t[0:2]), int(t[3:5]))
 
 
 def result(entry, index, converter):
@@ -98,45 +144,90 @@ class PvOutput:
         self.donation_mode = donation_mode
         self.dry_run = dry_run
         self.last_request_time = 0
+        self.rate_limit_remaining = None
+        self.rate_limit_reset = None
         self.session = requests.Session()
         self.session.headers.update(
             {
                 "X-Pvoutput-Apikey": apikey,
                 "X-Pvoutput-SystemId": systemid,
+                "X-Rate-Limit": "1",
                 "Content-type": "application/x-www-form-urlencoded",
                 "Accept": "text/plain",
             }
         )
+        # Only one host is used, so a small pool is enough to keep the
+        # connection alive between calls. Retry on gateway errors as these
+        # requests can safely be repeated.
+        self.session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=4,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=1.0,
+                    status_forcelist=[502, 503, 504],
+                    allowed_methods=["GET", "POST"],
+                    raise_on_status=False,
+                ),
+            ),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _throttle(self, min_interval=0):
+        # Spread the requests left in the rate limit window evenly over the
+        # time until it resets, and wait for the reset when none are left
+        last = self.last_request_time
+        next_request_time = last + min_interval
+        if self.rate_limit_remaining is not None:
+            if self.rate_limit_remaining <= 0:
+                next_request_time = max(next_request_time, self.rate_limit_reset)
+            else:
+                interval = (self.rate_limit_reset - last) / self.rate_limit_remaining
+                next_request_time = max(next_request_time, last + interval)
+        wait = next_request_time - time.time()
+        if wait > 0:
+            logging.debug("Rate limit, waiting %.1f s", wait)
+            time.sleep(wait)
 
     def send_request(self, url, params, ignore_dry_run=False):
-        params = {k: v for k, v in params.items() if v != ""}
+        params = {k: v for k, v in params.items() if v is not None}
 
         if self.dry_run and not ignore_dry_run:
             logging.debug("POST to %s: %s (dry-run)", url, params)
             return (requests.codes.ok, "OK", "")
 
-        time_since_last_request = time.time() - self.last_request_time
-        if time_since_last_request < 10:
-            time.sleep(10 - time_since_last_request)
+        self._throttle()
 
         logging.debug("POST to %s: %s", url, params)
-        headers = None
-        if self.donation_mode is None:
-            headers = {"X-Rate-Limit": "1"}
-
-        req = self.session.post(
-            "https://pvoutput.org%s" % url, headers=headers, data=params
-        )
+        req = self.session.post("https://pvoutput.org%s" % url, data=params)
 
         status = req.status_code
         reason = req.reason
         body = req.text
-        logging.debug(
-            "HTTP response: %d (%s): %s",
-            status,
-            reason,
-            body if len(body) < 120 else body[0:100] + " ... " + body[-20:],
-        )
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(
+                "HTTP response: %d (%s): %s",
+                status,
+                reason,
+                body if len(body) < 120 else body[0:100] + " ... " + body[-20:],
+            )
+
+        self.last_request_time = time.time()
+        remaining = req.headers.get("X-Rate-Limit-Remaining")
+        reset = req.headers.get("X-Rate-Limit-Reset")
+        if remaining is not None and reset is not None:
+            self.rate_limit_remaining = int(remaining)
+            self.rate_limit_reset = int(reset)
 
         if self.donation_mode is None:
             mode = req.headers["X-Rate-Limit-Limit"]
@@ -144,24 +235,15 @@ class PvOutput:
             logging.debug(
                 "Donation mode: %s (limit %s/%s)",
                 self.donation_mode,
-                req.headers["X-Rate-Limit-Remaining"],
+                remaining,
                 mode,
             )
 
-        self.last_request_time = time.time()
         return (status, reason, body)
 
     def add_output(self, output):
-        params = {
-            "d": output.date.strftime("%Y%m%d"),
-            "g": value(output, "generated", int),
-            "e": value(output, "exported", int),
-            "ip": value(output, "import_peak", int),
-            "io": value(output, "import_off_peak", int),
-            "is": value(output, "import_shoulder", int),
-            "ih": value(output, "import_high_shoulder", int),
-            "c": value(output, "consumption", int),
-        }
+        params = {"d": format_date(output.date)}
+        add_params(params, output, OUTPUT_PARAMS)
 
         (status, _, body) = self.send_request("/service/r2/addoutput.jsp", params)
         if status != requests.codes.ok:
@@ -170,21 +252,10 @@ class PvOutput:
 
     def add_status(self, status, net=None):
         params = {
-            "d": status.datetime.strftime("%Y%m%d"),
-            "t": status.datetime.strftime("%H:%M"),
-            "v1": value(status, "energy_generation", int),
-            "v2": value(status, "power_generation", int),
-            "v3": value(status, "energy_consumption", int),
-            "v4": value(status, "power_consumption", int),
-            "v5": value(status, "temperature", float),
-            "v6": value(status, "voltage", float),
-            "v7": value(status, "extended_1", float),
-            "v8": value(status, "extended_2", float),
-            "v9": value(status, "extended_3", float),
-            "v10": value(status, "extended_4", float),
-            "v11": value(status, "extended_5", float),
-            "v12": value(status, "extended_6", float),
+            "d": format_date(status.datetime),
+            "t": format_time(status.datetime),
         }
+        add_params(params, status, STATUS_PARAMS)
         if net is not None:
             params["n"] = int(net)
 
@@ -195,35 +266,39 @@ class PvOutput:
 
     def add_batch_status(self, statuses):
         data = []
+        # Statuses are typically many per day, so only format the date when
+        # it changes.
+        day = None
+        day_str = None
         for status in statuses:
-            entry = [
-                status.datetime.strftime("%Y%m%d"),
-                status.datetime.strftime("%H:%M"),
-                value(status, "energy_generation", int),
-                value(status, "power_generation", int),
-                value(status, "energy_consumption", int),
-                value(status, "power_consumption", int),
-                value(status, "temperature", float),
-                value(status, "voltage", float),
-                value(status, "extended_1", float),
-                value(status, "extended_2", float),
-                value(status, "extended_3", float),
-                value(status, "extended_4", float),
-                value(status, "extended_5", float),
-                value(status, "extended_6", float),
-            ]
+            if status.datetime.date() != day:
+                day = status.datetime.date()
+                day_str = format_date(day)
+            entry = [day_str, format_time(status.datetime)]
+            for _, field, converter in STATUS_PARAMS:
+                v = getattr(status, field)
+                entry.append("" if v is None else str(converter(v)))
             data.append(",".join(entry).rstrip(","))
         offset = 0
+        attempt = 0
         limit = 100 if self.donation_mode else 30
         while offset < len(data):
+            if offset > 0:
+                # pvoutput.org rejects a batch with "Load in progress" while
+                # it is still processing the previous one, so leave a gap
+                self._throttle(min_interval=10)
             entries = data[offset : offset + limit]
             (status, reason, body) = self.send_request(
                 "/service/r2/addbatchstatus.jsp", {"data": ";".join(entries)}
             )
             if status == requests.codes.ok:
                 offset += len(entries)
+                attempt = 0
             elif status == requests.codes.bad_request and "Load in progress" in body:
-                time.sleep(20)
+                # Back off exponentially (with some jitter) until the previous
+                # batch has been processed
+                time.sleep(min(120, 10 * 2**attempt) + random.uniform(0, 1))
+                attempt += 1
             else:
                 logging.error("Add batch status failed: %s", body)
                 raise Exception("Failed to add batch status")
@@ -240,13 +315,13 @@ class PvOutput:
         extended=False,
     ):
         params = {
-            "d": date.strftime("%Y%m%d") if date else "",
-            "t": time.strftime("%H:%M") if time else "",
+            "d": format_date(date) if date else None,
+            "t": format_time(time) if time else None,
             "h": 1 if history else 0,
             "asc": 1 if asc else 0,
             "limit": limit if limit is not None else 24 * 12,
-            "from": time_from.strftime("%H:%M") if time_from else "",
-            "to": time_to.strftime("%H:%M") if time_to else "",
+            "from": format_time(time_from) if time_from else None,
+            "to": format_time(time_to) if time_to else None,
             "ext": 1 if extended else 0,
         }
 
@@ -263,37 +338,31 @@ class PvOutput:
 
         for entry in body.split(";"):
             fields = entry.split(",")
-            statuses.append(
-                DefaultStatus._replace(
-                    datetime=datetime.combine(
-                        datetime.strptime(fields[0], "%Y%m%d").date(),
-                        datetime.strptime(fields[1], "%H:%M").time(),
-                    ),
-                    energy_generation=result(fields, 2, int),
-                    power_generation=result(fields, 4 if history else 3, int),
-                    energy_consumption=result(fields, 7 if history else 4, int),
-                    power_consumption=result(fields, 8 if history else 5, int),
-                    efficiency=result(fields, 3 if history else 6, float),
-                    temperature=result(fields, 9 if history else 7, float),
-                    voltage=result(fields, 10 if history else 8, float),
-                )
+            status = Status(
+                datetime=parse_datetime(fields[0], fields[1]),
+                energy_generation=result(fields, 2, int),
+                power_generation=result(fields, 4 if history else 3, int),
+                energy_consumption=result(fields, 7 if history else 4, int),
+                power_consumption=result(fields, 8 if history else 5, int),
+                efficiency=result(fields, 3 if history else 6, float),
+                temperature=result(fields, 9 if history else 7, float),
+                voltage=result(fields, 10 if history else 8, float),
             )
             if extended:
-                statuses[-1] = statuses[-1]._replace(
-                    extended_1=result(fields, 11 if history else 9, float),
-                    extended_2=result(fields, 12 if history else 10, float),
-                    extended_3=result(fields, 13 if history else 11, float),
-                    extended_4=result(fields, 14 if history else 12, float),
-                    extended_5=result(fields, 15 if history else 13, float),
-                    extended_6=result(fields, 16 if history else 14, float),
-                )
+                status.extended_1 = result(fields, 11 if history else 9, float)
+                status.extended_2 = result(fields, 12 if history else 10, float)
+                status.extended_3 = result(fields, 13 if history else 11, float)
+                status.extended_4 = result(fields, 14 if history else 12, float)
+                status.extended_5 = result(fields, 15 if history else 13, float)
+                status.extended_6 = result(fields, 16 if history else 14, float)
+            statuses.append(status)
         return statuses
 
     def get_output(self, date_from=None, date_to=None, limit=None):
         params = {
-            "df": date_from.strftime("%Y%m%d") if date_from else "",
-            "dt": date_to.strftime("%Y%m%d") if date_to else "",
-            "limit": limit if limit is not None else "",
+            "df": format_date(date_from) if date_from else None,
+            "dt": format_date(date_to) if date_to else None,
+            "limit": limit,
         }
 
         (status, _, body) = self.send_request(
@@ -310,8 +379,8 @@ class PvOutput:
         for entry in body.split(";"):
             fields = entry.split(",")
             outputs.append(
-                DefaultOutput._replace(
-                    date=datetime.strptime(fields[0], "%Y%m%d").date(),
+                Output(
+                    date=parse_date(fields[0]),
                     generated=result(fields, 1, int),
                     efficiency=result(fields, 2, float),
                     exported=result(fields, 3, int),
@@ -325,9 +394,9 @@ class PvOutput:
 
     def get_extended(self, date_from=None, date_to=None, limit=None):
         params = {
-            "df": date_from.strftime("%Y%m%d") if date_from else "",
-            "dt": date_to.strftime("%Y%m%d") if date_to else "",
-            "limit": limit if limit is not None else "",
+            "df": format_date(date_from) if date_from else None,
+            "dt": format_date(date_to) if date_to else None,
+            "limit": limit,
         }
 
         (status, _, body) = self.send_request(
@@ -345,7 +414,7 @@ class PvOutput:
             fields = entry.split(",")
             extended.append(
                 Extended(
-                    date=datetime.strptime(fields[0], "%Y%m%d").date(),
+                    date=parse_date(fields[0]),
                     extended_1=result(fields, 1, float),
                     extended_2=result(fields, 2, float),
                     extended_3=result(fields, 3, float),
@@ -358,7 +427,7 @@ class PvOutput:
         return extended
 
     def get_missing(self, date_from, date_to):
-        params = {"df": date_from.strftime("%Y%m%d"), "dt": date_to.strftime("%Y%m%d")}
+        params = {"df": format_date(date_from), "dt": format_date(date_to)}
 
         (status, _, body) = self.send_request(
             "/service/r2/getmissing.jsp", params, ignore_dry_run=True
@@ -370,7 +439,7 @@ class PvOutput:
         missing = []
         if body:
             for entry in body.split(","):
-                missing.append(datetime.strptime(entry, "%Y%m%d").date())
+                missing.append(parse_date(entry))
         return missing
 
 
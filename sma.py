@@ -32,16 +32,33 @@ import time
 ADDRESS = "239.12.255.255"
 PORT = 9522
 
+# Precompiled formats for the packet headers and response records.
+_UNIT_HDR = struct.Struct(">HH")
+_NET2_PROTO = struct.Struct(">H")
+_DEV_HDR = struct.Struct("<BBHLBBHLBBHHHBBH")
+_PARAM = struct.Struct("<L")
+_SIGNED_PARAM = struct.Struct("<l")
+_RESP_HDR = struct.Struct("<BHBL")
+_TEXT32 = struct.Struct("<32s")
+_STATUS8 = struct.Struct("<LLLLLLLL")
+_U64 = struct.Struct("<Q")
+_VEC5U = struct.Struct("<LLLLL")
+_VEC5S = struct.Struct("<lllll")
+_YIELD = struct.Struct("<LQ")
+
 
 class MalformedPacketError(Exception):
     pass
 
 
+_HEXDUMP_TEXT = bytes(x if chr(x).isalnum() else ord(".") for x in range(256))
+
+
 def hexdump(data, length=16):
     for offset in range(0, len(data), length):
-        segment = data[offset : offset + length]
-        hex = " ".join(["%02x" % b for b in segment])
-        text = "".join([(chr(x).isalnum() and chr(x)) or "." for x in segment])
+        segment = bytes(data[offset : offset + length])
+        hex = segment.hex(" ")
+        text = segment.translate(_HEXDUMP_TEXT).decode("latin-1")
         logging.debug("  %02x: %-*s %s" % (offset, 3 * length, hex, text))
 
 
@@ -60,13 +77,15 @@ class UnicastSocket:
 
     def send(self, data):
         logging.debug("Sending %d bytes to %s:%s", len(data), self.address, self.port)
-        hexdump(data)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            hexdump(data)
         self.socket.sendto(data, (self.address, self.port))
 
     def recv(self, bufsize=1500, return_peer=False):
         data, peer = self.socket.recvfrom(bufsize)
         logging.debug("Received %d bytes from %s:%s", len(data), peer[0], peer[1])
-        hexdump(data)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            hexdump(data)
         if return_peer:
             return data, peer
         return data
@@ -105,16 +124,20 @@ class DataPacket:
             if data[0 : len(DataPacket.HEADER)] != DataPacket.HEADER:
                 raise MalformedPacketError("SMA header incorrect")
 
-            # Unpack units
+            # Unpack units as views into the received data to avoid copies
+            view = memoryview(data)
+            size = len(data)
             offset = len(DataPacket.HEADER)
-            header_size = struct.calcsize(">HH")
-            while offset + header_size <= len(data):
-                (length, tag) = struct.unpack_from(">HH", data, offset)
+            header_size = _UNIT_HDR.size
+            unpack_header = _UNIT_HDR.unpack_from
+            append_unit = self.units.append
+            while offset + header_size <= size:
+                (length, tag) = unpack_header(data, offset)
                 offset += header_size
-                version = tag & 0xF
-                self.add_unit(tag >> 4, data[offset : offset + length], version)
+                unit_data = view[offset : offset + length]
+                append_unit(DataUnit(tag >> 4, tag & 0xF, unit_data or None))
                 offset += length
-            if offset != len(data):
+            if offset != size:
                 raise MalformedPacketError("data unit length missmatch")
 
             # Check for end unit and drop it
@@ -133,14 +156,22 @@ class DataPacket:
             units.append(extra_unit)
         units.append(DataUnit(DataPacket.TAG_END, 0, None))
 
-        data = DataPacket.HEADER
+        size = len(DataPacket.HEADER)
+        for unit in units:
+            size += _UNIT_HDR.size + (len(unit.data) if unit.data else 0)
+
+        data = bytearray(size)
+        offset = len(DataPacket.HEADER)
+        data[0:offset] = DataPacket.HEADER
         for unit in units:
             length = len(unit.data) if unit.data else 0
             tag = unit.tag << 4 | (unit.version & 0xF)
-            data += struct.pack(">HH", length, tag)
+            _UNIT_HDR.pack_into(data, offset, length, tag)
+            offset += _UNIT_HDR.size
             if unit.data:
-                data += unit.data
-        return data
+                data[offset : offset + length] = unit.data
+                offset += length
+        return bytes(data)
 
     def add_unit(self, tag, data, version=0):
         self.units.append(DataUnit(tag, version, data if data else None))
@@ -166,21 +197,19 @@ class Net2DataPacket(DataPacket):
         if data is not None:
             assert protocol is None
             # Extract the net 2 unit data
-            units = self.units
-            self.units = []
-            for unit in units:
+            for i, unit in enumerate(self.units):
                 if unit.tag == DataPacket.TAG_NET_2:
                     if len(unit.data) < 2:
                         raise MalformedPacketError("too short net 2 data")
-                    self.protocol = struct.unpack(">H", unit.data[0:2])[0]
+                    self.protocol = _NET2_PROTO.unpack_from(unit.data)[0]
                     self.net_data = unit.data[2:]
-                else:
-                    self.units.append(unit)
+                    del self.units[i]
+                    break
         if self.protocol is None:
             raise MalformedPacketError("no net 2 protocol found")
 
     def get_data(self):
-        data = struct.pack(">H", self.protocol) + self.net_data
+        data = _NET2_PROTO.pack(self.protocol) + self.net_data
         unit = DataUnit(DataPacket.TAG_NET_2, 0, data)
         return super().get_data(unit)
 
@@ -198,9 +227,16 @@ class DeviceDataPacket:
     CMD_JOB_RESPONSE = 13
     CMD_JOB_LOGOFF = 14
 
-    ReadResponseObject = namedtuple(
-        "ReadResponseObject", ["cls", "code", "timestamp", "data"]
-    )
+    class ReadResponseObject(
+        namedtuple("ReadResponseObject", ["cls", "code", "timestamp", "data"])
+    ):
+        """A read response record with the timestamp in seconds since epoch."""
+
+        __slots__ = ()
+
+        @property
+        def datetime(self):
+            return datetime.fromtimestamp(self.timestamp)
 
     PacketId = 1
 
@@ -213,28 +249,38 @@ class DeviceDataPacket:
             if self.packet.protocol != DeviceDataPacket.PROTOCOL:
                 raise MalformedPacketError("Not a device data packet")
 
-            if len(self.packet.net_data) < 28:
+            if len(self.packet.net_data) < _DEV_HDR.size:
                 raise MalformedPacketError("Too short device data packet")
-            v = struct.unpack_from("<BBHLBBHLBBHHHBBH", self.packet.net_data)
-            if v[0] * 4 != len(self.packet.net_data):
+            (
+                length,
+                self.control,
+                dst_susy_id,
+                dst_serial,
+                _,
+                job_num,
+                src_susy_id,
+                src_serial,
+                _,
+                _,
+                self.status,
+                self.packet_count,
+                packet_id,
+                self.command,
+                param_count,
+                self.obj,
+            ) = _DEV_HDR.unpack_from(self.packet.net_data)
+            if length * 4 != len(self.packet.net_data):
                 raise MalformedPacketError("Wrong device data packet length")
-            offset = 28
-
-            self.control = v[1]
-            self.destination = Address(v[2], v[3])
-            self.job_num = v[5] & 0xF
-            self.source = Address(v[6], v[7])
-            self.status = v[10]
-            self.packet_count = v[11]
-            self.packet_id = v[12] & ~0x8000
-            self.command = v[13]
-            self.obj = v[15]
-            if offset + v[14] * 4 > len(self.packet.net_data):
+            offset = _DEV_HDR.size
+
+            self.destination = Address(dst_susy_id, dst_serial)
+            self.job_num = job_num & 0xF
+            self.source = Address(src_susy_id, src_serial)
+            self.packet_id = packet_id & ~0x8000
+            if offset + param_count * 4 > len(self.packet.net_data):
                 raise MalformedPacketError("Bad device data packet params")
-            for param in range(v[14]):
-                self.params.append(
-                    struct.unpack_from("<L", self.packet.net_data, offset)[0]
-                )
+            for param in range(param_count):
+                self.params.append(_PARAM.unpack_from(self.packet.net_data, offset)[0])
                 offset += 4
             self.data = self.packet.net_data[offset:]
             logging.debug(
@@ -269,8 +315,10 @@ class DeviceDataPacket:
     def get_data(self):
         assert len(self.data) % 4 == 0
         length = 7 + len(self.params) + int(len(self.data) / 4)
-        data = struct.pack(
-            "<BBHLBBHLBBHHHBBH",
+        data = bytearray(4 * length)
+        _DEV_HDR.pack_into(
+            data,
+            0,
             length,
             self.control,
             self.destination.susy_id,
@@ -288,77 +336,76 @@ class DeviceDataPacket:
             len(self.params),
             self.obj,
         )
+        offset = _DEV_HDR.size
         for param in self.params:
-            data += struct.pack("<l", param)
-        data += self.data
-        self.packet.net_data = data
+            _SIGNED_PARAM.pack_into(data, offset, param)
+            offset += _SIGNED_PARAM.size
+        data[offset:] = self.data
+        self.packet.net_data = bytes(data)
         return self.packet.get_data()
 
     def decode_read_response(self):
         offset = 0
         response = []
-        while offset + 8 <= len(self.data):
-            (cls, code, data_type, timestamp) = struct.unpack_from(
-                "<BHBL", self.data, offset
-            )
-            offset += 8
-            response.append(
-                DeviceDataPacket.ReadResponseObject(
-                    cls=cls,
-                    code=code,
-                    timestamp=datetime.fromtimestamp(timestamp),
-                    data=None,
-                )
-            )
+        while offset + _RESP_HDR.size <= len(self.data):
+            (cls, code, data_type, timestamp) = _RESP_HDR.unpack_from(self.data, offset)
+            offset += _RESP_HDR.size
             logging.debug(
-                "Got class=0x%x code=0x%x type=0x%x time=%s",
+                "Got class=0x%x code=0x%x type=0x%x time=%u",
                 cls,
                 code,
                 data_type,
-                response[-1].timestamp,
+                timestamp,
             )
+            data = None
             if data_type == 0x10:
                 # Text: 32 bytes of NULL terminated string
-                (text,) = struct.unpack_from("<32s", self.data, offset)
+                (text,) = _TEXT32.unpack_from(self.data, offset)
                 offset += len(text)
-                response[-1] = response[-1]._replace(
-                    data=text.rstrip(b"\0").decode("utf-8")
-                )
-                logging.debug(" -> text '%s'", response[-1].data)
+                data = text.rstrip(b"\0").decode("utf-8")
+                logging.debug(" -> text '%s'", data)
             elif data_type == 0x8:
                 # Status: eight 32-bit words
-                attributes = struct.unpack_from("<LLLLLLLL", self.data, offset)
+                attributes = _STATUS8.unpack_from(self.data, offset)
                 offset += 4 * len(attributes)
-                response[-1] = response[-1]._replace(data=[])
+                data = []
                 for attribute in attributes:
                     tag = attribute & 0xFFFFFF
                     is_set = attribute >> 24
                     if tag == 0xFFFFFE:  # End tag
                         break
                     if is_set:
-                        response[-1].data.append(tag)
+                        data.append(tag)
                     logging.debug(" -> attribute %d = %d", tag, is_set)
             elif self.obj == 0x5400:
                 # 64-bit integer
-                (value,) = struct.unpack_from("<Q", self.data, offset)
-                offset += 8
+                (value,) = _U64.unpack_from(self.data, offset)
+                offset += _U64.size
                 if value != 0xFFFFFFFFFFFFFFFF:
-                    response[-1] = response[-1]._replace(data=value)
+                    data = value
                 logging.debug(" -> value 0x%08x (%d)", value, value)
             elif data_type == 0x0 or data_type == 0x40:
                 # Five 32-bit integers
-                fmt = 5 * ("L" if data_type == 0x0 else "l")
-                values = struct.unpack_from("<%s" % fmt, self.data, offset)
-                offset += 4 * len(values)
-                response[-1] = response[-1]._replace(data=[])
+                vec5 = _VEC5U if data_type == 0x0 else _VEC5S
+                values = vec5.unpack_from(self.data, offset)
+                offset += vec5.size
+                data = []
                 for value in values:
                     logging.debug(" -> value 0x%08x (%d)", abs(value), value)
                     if (data_type == 0x0 and value != 0xFFFFFFFF) or (
                         data_type == 0x40 and value != -0x80000000
                     ):
-                        response[-1].data.append(value)
+                        data.append(value)
                     else:
-                        response[-1].data.append(None)
+                        data.append(None)
+            response.append(
+                DeviceDataPacket.ReadResponseObject(
+                    cls=cls,
+                    code=code,
+                    timestamp=timestamp,
+                    data=data,
+                )
+            )
         assert offset == len(self.data)
         return response
 
@@ -372,10 +419,6 @@ def detect_inverters(sock, timeout=5, retry=3):
     device.add_param(0)
     sock.send(device.get_data())
 
-    # message = DataPacket()
-    # message.add_unit(DataPacket.TAG_DISCOVER, None)
-    # send_message(sock, message.get_data(), ADDRESS, PORT)
-
     end = time.time() + timeout
     inverters = []
     while True:
@@ -424,6 +467,9 @@ class Inverter:
     CODE_AC_CURRENT_L2 = 0x4651
     CODE_AC_CURRENT_L3 = 0x4652
 
+    # Password encoding tables, one per user type
+    _password_tables = {}
+
     def __init__(self, sock, address):
         self.socket = sock
         self.address = address
@@ -436,8 +482,11 @@ class Inverter:
         return current / 1000.0 if current else current
 
     def login(self, user_type, password):
-        encoded = bytes(map(lambda x: ord(x) + user_type, password))
-        encoded += max(0, 12 - len(password)) * bytes(user_type)
+        table = Inverter._password_tables.get(user_type)
+        if table is None:
+            table = bytes((x + user_type) & 0xFF for x in range(256))
+            Inverter._password_tables[user_type] = table
+        encoded = password.encode("ascii").translate(table)
         packet = DeviceDataPacket(
             source=self.local_address,
             destination=self.address,
@@ -445,7 +494,7 @@ class Inverter:
             obj=Inverter.OBJ_LOGIN,
             job_num=Inverter.JOB_NUM_LOGIN,
         )
-        packet.data = encoded[0:12]
+        packet.data = encoded[0:12].ljust(12, b"\0")
         packet.add_param(7 if user_type == 0x88 else 10)
         packet.add_param(300)
         packet.add_param(int(time.time()))
@@ -643,9 +692,9 @@ class Inverter:
             response = DeviceDataPacket(self.socket.recv())
 
             offset = 0
-            while offset + 12 <= len(response.data):
-                (timestamp, energy) = struct.unpack_from("<LQ", response.data, offset)
-                offset += 12
+            while offset + _YIELD.size <= len(response.data):
+                (timestamp, energy) = _YIELD.unpack_from(response.data, offset)
+                offset += _YIELD.size
                 timestamp = datetime.fromtimestamp(timestamp)
                 logging.debug(
                     "Yield @ %s: %d Wh (%.3f MWh)",
@@ -673,9 +722,9 @@ class Inverter:
             response = DeviceDataPacket(self.socket.recv())
 
             offset = 0
-            while offset + 12 <= len(response.data):
-                (timestamp, energy) = struct.unpack_from("<LQ", response.data, offset)
-                offset += 12
+            while offset + _YIELD.size <= len(response.data):
+                (timestamp, energy) = _YIELD.unpack_from(response.data, offset)
+                offset += _YIELD.size
                 timestamp = datetime.fromtimestamp(timestamp)
                 logging.debug(
                     "Yield @ %s: %d Wh (%.3f MWh)",
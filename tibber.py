@@ -22,6 +22,14 @@ import requests
 from collections import namedtuple
 from datetime import datetime
 from enum import Enum
+from operator import attrgetter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 Consumption = namedtuple("Consumption", "date consumption unit_price cost")
@@ -35,24 +43,31 @@ EnergyResolution = Enum("EnergyResolution", "HOURLY DAILY WEEKLY MONTHLY ANNUAL"
 class Client:
     ENDPOINT = "https://api.tibber.com/v1-beta/gql"
 
-    class Authentication(requests.auth.AuthBase):
-        def __init__(self, token):
-            self.token = token
-
-        def __call__(self, req):
-            req.headers["Authorization"] = f"Bearer {self.token}"
-            return req
-
     def __init__(self, token):
         self._session = requests.Session()
-        self._session.auth = self.Authentication(token)
+        self._session.headers["Authorization"] = f"Bearer {token}"
+        # The queries only read data, so retry them on gateway errors and
+        # when rate limited. raise_for_status reports the final failure.
+        self._session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=1,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.3,
+                    status_forcelist=[429, 502, 503, 504],
+                    allowed_methods=["POST"],
+                    raise_on_status=False,
+                ),
+            ),
+        )
 
     def do_query(self, query):
         query = "{ viewer { %s } }" % query
         logging.debug(query)
         req = self._session.post(self.ENDPOINT, json={"query": query})
         req.raise_for_status()
-        return req.json()["data"]["viewer"]
+        return json_loads(req.content)["data"]["viewer"]
 
     def get_homes(self):
         res = self.do_query("homes { id }")
@@ -60,24 +75,36 @@ class Client:
 
 
 class Home:
+    # Default number of nodes fetched per query. Pass page_size to Home to
+    # override (e.g. lower) these per resolution.
     PAGE_SIZE = {
-        EnergyResolution.HOURLY: 48,
-        EnergyResolution.DAILY: 14,
-        EnergyResolution.WEEKLY: 4,
-        EnergyResolution.MONTHLY: 6,
-        EnergyResolution.ANNUAL: 5,
+        EnergyResolution.HOURLY: 720,
+        EnergyResolution.DAILY: 90,
+        EnergyResolution.WEEKLY: 26,
+        EnergyResolution.MONTHLY: 24,
+        EnergyResolution.ANNUAL: 10,
     }
 
-    def __init__(self, client, home_id):
+    def __init__(self, client, home_id, page_size=None):
         self._client = client
         self.home_id = home_id
+        self.page_size = dict(self.PAGE_SIZE)
+        if page_size is not None:
+            self.page_size.update(page_size)
 
     def do_query(self, query):
         res = self._client.do_query(f'home(id: "{self.home_id}") {{ {query} }}')
         return res["home"]
 
     def get_data(
-        self, consumption, resolution, first=None, last=None, before=None, after=None,
+        self,
+        consumption,
+        resolution,
+        first=None,
+        last=None,
+        before=None,
+        after=None,
+        reverse=False,
     ):
         # Not setting filterEmptyNodes: true as that removes nodes with
         # e.g. consumption == 0 (and not just == null, i.e. unknown).
@@ -105,7 +132,7 @@ class Home:
 
         def to_tuple(cls, node):
             return cls(
-                datetime.strptime(node["from"], "%Y-%m-%dT%H:%M:%S.%f%z"),
+                datetime.fromisoformat(node["from"]),
                 int(node[name] * 1000),
                 node["unitPrice"],
                 round(node[money], 2),
@@ -116,29 +143,34 @@ class Home:
             pi["startCursor"], pi["endCursor"], pi["hasPreviousPage"], pi["hasNextPage"]
         )
         cls = Consumption if consumption else Production
+        nodes = reversed(res["nodes"]) if reverse else res["nodes"]
         return (
-            [to_tuple(cls, n) for n in res["nodes"] if n[name] is not None],
+            [to_tuple(cls, n) for n in nodes if n[name] is not None],
             page_info,
         )
 
-    def data_generator(self, consumption, resolution, reverse):
+    def pages(self, resolution, consumption=True, reverse=False):
+        """Yields the entries one page (i.e. query) at a time."""
         kwargs = {
             "consumption": consumption,
             "resolution": resolution,
+            "reverse": reverse,
         }
-        kwargs["last" if reverse else "first"] = self.PAGE_SIZE[resolution]
+        kwargs["last" if reverse else "first"] = self.page_size[resolution]
 
         page_info = PageInfo(None, None, True, True)
-        has_more = "has_previous" if reverse else "has_next"
-        cursor = "start_cursor" if reverse else "end_cursor"
+        has_more = attrgetter("has_previous" if reverse else "has_next")
+        cursor = attrgetter("start_cursor" if reverse else "end_cursor")
+        cursor_arg = "before" if reverse else "after"
 
-        while getattr(page_info, has_more):
-            kwargs["before" if reverse else "after"] = getattr(page_info, cursor)
+        while has_more(page_info):
+            kwargs[cursor_arg] = cursor(page_info)
             entries, page_info = self.get_data(**kwargs)
-            if reverse:
-                entries = reversed(entries)
-            for entry in entries:
-                yield entry
+            yield entries
+
+    def data_generator(self, consumption, resolution, reverse):
+        for entries in self.pages(resolution, consumption, reverse):
+            yield from entries
 
     def consumption(self, resolution, reverse=False):
         yield from self.data_generator(True, resolution, reverse)
@@ -149,16 +181,23 @@ class Home:
 
 if __name__ == "__main__":
     from datetime import timedelta
-    from http.client import HTTPConnection
     import logging
     import sys
 
     logging.basicConfig()
     logging.getLogger().setLevel(logging.DEBUG)
 
-    HTTPConnection.debuglevel = 1
-
     client = Client(sys.argv[1])
+    client._session.hooks["response"].append(
+        lambda r, *args, **kwargs: logging.debug(
+            "%s %s -> %d (%d bytes) in %s",
+            r.request.method,
+            r.url,
+            r.status_code,
+            len(r.content),
+            r.elapsed,
+        )
+    )
     for home in client.get_homes():
         # for c in home.consumption(EnergyResolution.ANNUAL, reverse=False):
         #     print(c)